@@ -1,4 +1,5 @@
 import os
+import re
 import requests
 import tarfile
 import pandas as pd
@@ -6,6 +7,7 @@ import time
 from datetime import datetime, timedelta
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from trip_dedup import TripDeduplicator, archive_date
 
 # 設置重試機制
 def get_session():
@@ -66,11 +68,13 @@ while current_date <= end_date:
 # 解壓縮並合併CSV檔案
 print("開始解壓縮和合併檔案...")
 yearly_data = []
+dedup = TripDeduplicator()
 
 # 處理資料夾中的所有.tar.gz檔案
 for file_name in sorted(os.listdir('data')):
-    if file_name.endswith('.tar.gz') and file_name.startswith("M06A_2024"):
+    if re.match(r'M06A_2024\d{4}.*\.tar\.gz$', file_name):
         file_path = os.path.join('data', file_name)
+        dedup.start_day(archive_date(file_name))
         
         try:
             print(f"正在解壓縮: {file_name}")
@@ -80,10 +84,14 @@ for file_name in sorted(os.listdir('data')):
                     if member.name.endswith('.csv'):
                         f = tar.extractfile(member)
                         if f:
-                            df = pd.read_csv(f)
+                            df = dedup.filter(pd.read_csv(f))
                             yearly_data.append(df)
         except Exception as e:
             print(f"處理 {file_name} 時發生錯誤: {str(e)}")
+        finally:
+            print(f"跨日重複旅次：移除 {dedup.end_day():,} 筆")
+
+dedup.report()
 
 # 合併年度資料並儲存
 if yearly_data:
@@ -0,0 +1,247 @@
+# 旅行時間預測特徵矩陣：將各路段旅行時間分箱到固定時間格，以 NumPy 滑動視窗建立落後與滾動特徵
+
+import os
+import glob
+import json
+import traceback
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from trip_store import TripStore, SECONDS_PER_DAY, new_version, publish_version
+
+# 設定資料路徑
+STORE_DIR = 'D:/highway_processed/trip_store'
+CACHE_DIR = 'D:/highway_processed/feature_store'
+RAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '國道五號雨量資料_2024')
+
+# 特徵參數
+BIN_MINUTES = 15
+TOP_ROUTES = 200
+LAGS = (1, 2, 4)
+WINDOWS = (4, 12)
+
+
+def select_routes(store, top_routes):
+    """依旅次數選出最常見的路段 (起始門架, 結束門架)"""
+    n = len(store.gantries)
+    counts = np.zeros(n * n, dtype=np.int64)
+    for date in store.days():
+        data = store.day(date, ['location_start', 'location_end'])
+        route = data['location_start'].astype(np.int64) * n + data['location_end']
+        counts += np.bincount(route, minlength=n * n)
+    routes = np.argsort(counts)[::-1][:top_routes]
+    return np.sort(routes[counts[routes] > 0])
+
+
+def bin_travel_times(store, routes, bin_minutes):
+    """將各路段的旅行時間平均到固定時間格，回傳 (起始時間, 平均旅行時間矩陣, 筆數矩陣)"""
+    n = len(store.gantries)
+    bins_per_day = 24 * 60 // bin_minutes
+    bin_seconds = bin_minutes * 60
+    first_day = int(store.day_keys[0])
+    n_days = int(store.day_keys[-1]) - first_day + 1
+
+    # 路段代碼 -> 矩陣列號，未選取的路段為 -1
+    lookup = np.full(n * n, -1, dtype=np.int64)
+    lookup[routes] = np.arange(len(routes))
+
+    sums = np.zeros((len(routes), n_days * bins_per_day))
+    counts = np.zeros((len(routes), n_days * bins_per_day), dtype=np.int64)
+    size = len(routes) * bins_per_day
+    for key, date in zip(store.day_keys, store.days()):
+        data = store.day(date, ['time', 'time_end', 'location_start', 'location_end'])
+        row = lookup[data['location_start'].astype(np.int64) * n + data['location_end']]
+        keep = row >= 0
+        local_bin = (data['time'][keep] % SECONDS_PER_DAY) // bin_seconds
+        index = row[keep] * bins_per_day + local_bin
+        travel_time = (data['time_end'][keep] - data['time'][keep]) / 60  # 轉換為分鐘
+        start = (int(key) - first_day) * bins_per_day
+        sums[:, start:start + bins_per_day] += np.bincount(index, weights=travel_time, minlength=size).reshape(-1, bins_per_day)
+        counts[:, start:start + bins_per_day] += np.bincount(index, minlength=size).reshape(-1, bins_per_day)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(counts > 0, sums / counts, np.nan)
+    bin_start = first_day * SECONDS_PER_DAY + np.arange(n_days * bins_per_day, dtype=np.int64) * bin_seconds
+    return bin_start, mean, counts
+
+
+def shift(matrix, lag):
+    """沿時間軸往後平移 lag 格，前面補 NaN"""
+    out = np.full_like(matrix, np.nan)
+    out[:, lag:] = matrix[:, :-lag]
+    return out
+
+
+def rolling_mean_std(matrix, window):
+    """以滑動視窗計算滾動平均與標準差 (忽略 NaN)"""
+    valid = ~np.isnan(matrix)
+    filled = np.where(valid, matrix, 0.0)
+    pad = ((0, 0), (window - 1, 0))
+    s = sliding_window_view(np.pad(filled, pad), window, axis=1).sum(axis=-1)
+    s2 = sliding_window_view(np.pad(filled ** 2, pad), window, axis=1).sum(axis=-1)
+    c = sliding_window_view(np.pad(valid.astype(np.float64), pad), window, axis=1).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(c > 0, s / c, np.nan)
+        std = np.where(c > 1, np.sqrt(np.maximum(s2 / c - mean ** 2, 0)), np.nan)
+    return mean, std
+
+
+def latest_rain_file(rain_dir):
+    """最新的國道五號逐時雨量資料檔，找不到時回傳 None"""
+    files = sorted(glob.glob(os.path.join(rain_dir, '國道五號雨量資料_逐時_*.csv')))
+    return files[-1] if files else None
+
+
+def load_hourly_rainfall(rain_file, bin_start):
+    """讀取逐時雨量資料並對齊到每個時間格，回傳 (平均雨量, 最大雨量, 前3小時累積雨量)
+
+    雨量檔只記錄有降雨的時段：檔案涵蓋的日期內未出現的時段視為 0，涵蓋期間外為 NaN (未知)。
+    """
+    first_hour = bin_start[0] // 3600
+    n_hours = int((bin_start[-1] // 3600) - first_hour + 1)
+    rain_mean = np.full(n_hours, np.nan)
+    rain_max = np.full(n_hours, np.nan)
+    if rain_file is not None:
+        rain = pd.read_csv(rain_file, encoding='utf-8-sig')
+        day = pd.to_datetime(rain['日期']).values.astype('datetime64[h]').astype(np.int64)
+        hour = day + rain['時'].values
+        stations = rain['觀測站'].nunique()
+
+        # 涵蓋期間：檔案中第一天 00 時至最後一天 23 時
+        covered_from = max(int(day.min()) - first_hour, 0)
+        covered_to = min(max(int(day.max()) + 24 - first_hour, 0), n_hours)
+        rain_mean[covered_from:covered_to] = 0.0
+        rain_max[covered_from:covered_to] = 0.0
+
+        index = hour - first_hour
+        keep = (index >= covered_from) & (index < covered_to)
+        rain_mean += np.bincount(index[keep], weights=rain['雨量(mm)'].values[keep], minlength=n_hours) / stations
+        np.maximum.at(rain_max, index[keep], rain['雨量(mm)'].values[keep])
+    else:
+        print("警告：找不到逐時雨量資料，雨量特徵皆為 NaN")
+    # 前3小時中有任一小時未知時結果為 NaN
+    rain_3h = sliding_window_view(np.pad(rain_mean, (2, 0), constant_values=np.nan), 3).sum(axis=-1)
+    bin_hour = bin_start // 3600 - first_hour
+    return rain_mean[bin_hour], rain_max[bin_hour], rain_3h[bin_hour]
+
+
+def build_features(store, rain_file, bin_minutes=BIN_MINUTES, top_routes=TOP_ROUTES, lags=LAGS, windows=WINDOWS):
+    """建立長格式特徵矩陣 (每列為一個路段的一個時間格)，只保留有目標值的資料"""
+    routes = select_routes(store, top_routes)
+    bin_start, target, counts = bin_travel_times(store, routes, bin_minutes)
+    n_routes, n_bins = target.shape
+    bins_per_week = 7 * 24 * 60 // bin_minutes
+
+    features = {f"lag_{lag}": shift(target, lag) for lag in lags}
+    previous = shift(target, 1)  # 滾動特徵只使用過去的時間格，避免洩漏目標值
+    for window in windows:
+        features[f"roll_mean_{window}"], features[f"roll_std_{window}"] = rolling_mean_std(previous, window)
+    features['last_week'] = shift(target, bins_per_week)
+
+    rain_mean, rain_max, rain_3h = load_hourly_rainfall(rain_file, bin_start)
+
+    keep = ~np.isnan(target)
+    row, col = np.nonzero(keep)
+    n = len(store.gantries)
+    columns = {
+        'location_start': (routes[row] // n).astype(np.int16),
+        'location_end': (routes[row] % n).astype(np.int16),
+        'time': bin_start[col],
+        'hour': ((bin_start[col] % SECONDS_PER_DAY) // 3600).astype(np.uint8),
+        'weekday': ((bin_start[col] // SECONDS_PER_DAY + 3) % 7).astype(np.uint8),  # 1970-01-01 為週四
+        'count': counts[keep].astype(np.int32),
+        'travel_time': target[keep].astype(np.float32),
+    }
+    for name, matrix in features.items():
+        columns[name] = matrix[keep].astype(np.float32)
+    columns['rain_mean'] = rain_mean[col].astype(np.float32)
+    columns['rain_max'] = rain_max[col].astype(np.float32)
+    columns['rain_3h'] = rain_3h[col].astype(np.float32)
+    return columns
+
+
+def save_features(columns, cache_dir, params, gantries):
+    """以每欄一個 .npy 的欄式格式儲存特徵矩陣
+
+    與旅次資料庫相同，寫入新的版本子目錄後才以 os.replace 更新 meta.json，
+    中斷的寫入不會留下欄位不一致的快取。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    version = new_version()
+    version_dir = os.path.join(cache_dir, version)
+    os.makedirs(version_dir)
+    for name, arr in columns.items():
+        np.save(os.path.join(version_dir, f"{name}.npy"), arr)
+    meta = dict(params, version=version, rows=int(len(columns['time'])), columns=list(columns),
+                gantries=gantries, created=datetime.now().isoformat(timespec='seconds'))
+    publish_version(cache_dir, meta)
+
+
+def load_features(cache_dir, params=None):
+    """讀取快取的特徵矩陣為 DataFrame，參數或來源不符時回傳 None"""
+    meta_file = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if 'version' not in meta or params is not None and any(meta.get(k) != v for k, v in params.items()):
+        return None
+    version_dir = os.path.join(cache_dir, meta['version'])
+    return pd.DataFrame({name: np.load(os.path.join(version_dir, f"{name}.npy")) for name in meta['columns']})
+
+
+def get_features(store_dir=STORE_DIR, cache_dir=CACHE_DIR, rain_dir=RAIN_DIR, bin_minutes=BIN_MINUTES,
+                 top_routes=TOP_ROUTES, lags=LAGS, windows=WINDOWS):
+    """取得特徵矩陣，快取有效時直接讀取，否則重新建立"""
+    store = TripStore(store_dir)
+    rain_file = latest_rain_file(rain_dir)
+    params = {
+        'store_version': store.meta['version'],
+        'rain_file': os.path.basename(rain_file) if rain_file else None,
+        'rain_mtime': os.path.getmtime(rain_file) if rain_file else None,
+        'bin_minutes': bin_minutes,
+        'top_routes': top_routes,
+        'lags': list(lags),
+        'windows': list(windows),
+    }
+    features = load_features(cache_dir, params)
+    if features is not None:
+        print(f"使用快取的特徵矩陣：{cache_dir}")
+        return features
+    print("建立特徵矩陣...")
+    columns = build_features(store, rain_file, bin_minutes, top_routes, lags, windows)
+    save_features(columns, cache_dir, params, store.gantries)
+    return load_features(cache_dir)
+
+
+def main():
+    if not os.path.exists(os.path.join(STORE_DIR, 'meta.json')):
+        print(f"錯誤: 找不到旅次資料庫 {STORE_DIR}，請先執行 trip_store.py")
+        return
+
+    print(f"\n開始建立旅行時間預測特徵...")
+    print(f"旅次資料庫：{STORE_DIR}")
+    print(f"雨量資料：{RAIN_DIR}")
+    start_time = datetime.now()
+
+    try:
+        features = get_features()
+    except Exception as e:
+        print(f"\n建立特徵時發生錯誤：")
+        print(traceback.format_exc())
+        return
+
+    total_time = (datetime.now() - start_time).total_seconds()
+    print("\n完成！")
+    print(f"總處理時間：{total_time:.1f} 秒")
+    print(f"特徵筆數：{len(features):,} 筆")
+    print(f"特徵欄位：{features.columns.tolist()}")
+    print(f"輸出目錄：{CACHE_DIR}")
+    print("\n特徵預覽：")
+    print(features.head())
+
+
+if __name__ == "__main__":
+    main()
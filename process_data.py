@@ -1,9 +1,11 @@
 import os
+import re
 import pandas as pd
 import tarfile
 import shutil
 import sys
 import traceback
+from trip_dedup import TripDeduplicator, archive_date
 
 # 取得目前檔案所在的目錄路徑
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -29,7 +31,8 @@ try:
         raise FileNotFoundError(f"找不到資料來源目錄: {data_dir}")
     
     # 檢查是否有.tar.gz檔案
-    tar_files = [f for f in os.listdir(data_dir) if f.endswith('.tar.gz') and '2024' in f]
+    # 只處理 M06A_2024MMDD 的每日壓縮檔，去重需要由檔名取得日期
+    tar_files = [f for f in os.listdir(data_dir) if re.match(r'M06A_2024\d{4}.*\.tar\.gz$', f)]
     if not tar_files:
         raise FileNotFoundError(f"在 {data_dir} 中找不到2024年的.tar.gz檔案")
     
@@ -39,11 +42,15 @@ try:
     output_file = os.path.join(output_dir, '2024_M06A.csv')
     header_saved = False
     
+    # 跨日重複旅次去重
+    dedup = TripDeduplicator()
+    
     # 處理資料夾中的所有.tar.gz檔案
     for file_name in sorted(tar_files):
         file_path = os.path.join(data_dir, file_name)
         file_size = os.path.getsize(file_path) / (1024 * 1024)  # 轉換為MB
         print(f"\n正在處理: {file_name} (大小: {file_size:.2f} MB)")
+        dedup.start_day(archive_date(file_name))
         
         try:
             with tarfile.open(file_path, 'r:gz') as tar:
@@ -70,6 +77,7 @@ try:
                             print("  開始分批處理CSV檔案...")
                             
                             for chunk in pd.read_csv(temp_csv, chunksize=chunk_size):
+                                chunk = dedup.filter(chunk)
                                 if not header_saved:
                                     chunk.to_csv(output_file, mode='w', index=False)
                                     header_saved = True
@@ -88,6 +96,11 @@ try:
             print(f"\n處理 {file_name} 時發生錯誤:")
             print(traceback.format_exc())
             continue
+        finally:
+            removed = dedup.end_day()
+            print(f"  跨日重複旅次：移除 {removed:,} 筆")
+    
+    dedup.report()
     
     # 清理臨時資料夾
     shutil.rmtree(temp_dir)
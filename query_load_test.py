@@ -0,0 +1,70 @@
+# 對本機查詢服務進行壓力測試，回報 p50/p99 延遲
+
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.request import urlopen
+import numpy as np
+
+# 設定服務位址與測試參數
+base_url = 'http://127.0.0.1:8050'
+total_requests = 5000
+concurrency = 16
+stations = ['宜蘭', '新北', '臺北']
+
+
+def fetch(path, params=None):
+    """送出查詢並回傳 (延遲毫秒, 狀態碼)"""
+    url = f"{base_url}{path}"
+    if params:
+        url += '?' + urlencode(params)
+    start = time.perf_counter()
+    try:
+        with urlopen(url, timeout=30) as response:
+            response.read()
+            status = response.status
+    except Exception as e:
+        status = getattr(e, 'code', 0)
+    return (time.perf_counter() - start) * 1000, status
+
+
+def build_queries(routes):
+    """依熱門路段組合查詢，模擬儀表板與筆記本的查詢分布"""
+    queries = [('/cluster_stats', None)]
+    for route in routes:
+        queries.append(('/route_hourly', route))
+        queries.append(('/route_hourly', dict(route, hour=random.randint(0, 23))))
+        for station in stations:
+            queries.append(('/rain_join', dict(route, station=station)))
+    return queries
+
+
+# 取得熱門路段
+with urlopen(f"{base_url}/routes?limit=20", timeout=30) as response:
+    routes = [{'start': r['start'], 'end': r['end']} for r in json.load(response)]
+print(f"取得 {len(routes)} 個熱門路段")
+
+queries = build_queries(routes)
+workload = [random.choice(queries) for _ in range(total_requests)]
+
+print(f"開始測試：{total_requests:,} 次查詢，並行數 {concurrency}")
+start_time = time.perf_counter()
+with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    results = list(executor.map(lambda q: fetch(*q), workload))
+total_time = time.perf_counter() - start_time
+
+latencies = np.array([latency for latency, _ in results])
+errors = sum(1 for _, status in results if status != 200)
+
+print("\n測試完成！")
+print(f"總時間：{total_time:.1f} 秒 (每秒約 {total_requests/total_time:.0f} 次查詢)")
+print(f"失敗次數：{errors}")
+print(f"p50 延遲：{np.percentile(latencies, 50):.2f} ms")
+print(f"p99 延遲：{np.percentile(latencies, 99):.2f} ms")
+print(f"最大延遲：{latencies.max():.2f} ms")
+
+with urlopen(f"{base_url}/metrics", timeout=30) as response:
+    metrics = json.load(response)
+print(f"快取命中率：{metrics['cache_hit_rate']*100:.1f}% (命中 {metrics['cache_hits']:,}，未命中 {metrics['cache_misses']:,})")
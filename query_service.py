@@ -0,0 +1,303 @@
+# 本機查詢服務：載入一次彙總資料，以 LRU 快取回應路段旅行時間、聚類統計與雨量查詢
+
+import os
+import glob
+import json
+import threading
+import traceback
+from datetime import datetime
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+import numpy as np
+import pandas as pd
+
+from trip_store import TripStore
+
+# 設定資料路徑
+STORE_DIR = 'D:/highway_processed/trip_store'
+RAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '國道五號雨量資料_2024')
+
+HOST = '127.0.0.1'
+PORT = 8050
+CACHE_SIZE = 1024
+RELOAD_INTERVAL = 30  # 檢查資料庫是否更新的間隔 (秒)
+
+
+def load_daily_rainfall(rain_dir):
+    """讀取最新的國道五號逐日雨量資料"""
+    files = sorted(glob.glob(os.path.join(rain_dir, '國道五號雨量資料_逐日_*.csv')))
+    if not files:
+        print(f"警告：在 {rain_dir} 找不到逐日雨量資料")
+        return pd.DataFrame(columns=['觀測站', 'date', '日累積雨量(mm)'])
+    rain = pd.read_csv(files[-1], encoding='utf-8-sig')
+    rain['date'] = pd.to_datetime(dict(year=rain['年份'], month=rain['月份'], day=rain['日']))
+    return rain[['觀測站', 'date', '日累積雨量(mm)']]
+
+
+class Aggregates:
+    """由旅次資料庫逐日彙總的統計資料，只在啟動或重新載入時計算一次"""
+
+    def __init__(self, store_dir, rain_dir, cache_size=CACHE_SIZE):
+        store = TripStore(store_dir)
+        self.gantries = store.gantries
+        self.gantry_codes = store.gantry_codes
+        n = len(self.gantries)
+        n_routes = n * n
+
+        # 各路段每小時的旅行時間總和與筆數
+        hourly_sum = np.zeros(n_routes * 24)
+        hourly_count = np.zeros(n_routes * 24, dtype=np.int64)
+        # 各聚類的筆數、旅行時間總和、平方和與數值總和
+        cluster_count = np.zeros(256, dtype=np.int64)
+        cluster_sum = np.zeros(256)
+        cluster_sumsq = np.zeros(256)
+        cluster_value = np.zeros(256)
+        daily = []
+
+        for date in store.days():
+            data = store.day(date, ['time', 'time_end', 'location_start', 'location_end', 'value', 'cluster'])
+            travel_time = (data['time_end'] - data['time']) / 60  # 轉換為分鐘
+            route = data['location_start'].astype(np.int64) * n + data['location_end']
+            hour = (data['time'] % 86400) // 3600
+            key = route * 24 + hour
+            hourly_sum += np.bincount(key, weights=travel_time, minlength=n_routes * 24)
+            hourly_count += np.bincount(key, minlength=n_routes * 24)
+
+            cluster = data['cluster']
+            cluster_count += np.bincount(cluster, minlength=256)
+            cluster_sum += np.bincount(cluster, weights=travel_time, minlength=256)
+            cluster_sumsq += np.bincount(cluster, weights=travel_time ** 2, minlength=256)
+            cluster_value += np.bincount(cluster, weights=data['value'], minlength=256)
+
+            day_sum = np.bincount(route, weights=travel_time, minlength=n_routes)
+            day_count = np.bincount(route, minlength=n_routes)
+            used = np.flatnonzero(day_count)
+            daily.append(pd.DataFrame({
+                'route': used,
+                'date': pd.Timestamp(date),
+                'mean_travel_time': day_sum[used] / day_count[used],
+                'count': day_count[used],
+            }))
+
+        used = np.flatnonzero(hourly_count)
+        self.route_hourly = pd.DataFrame({
+            'route': used // 24,
+            'hour': used % 24,
+            'mean_travel_time': hourly_sum[used] / hourly_count[used],
+            'count': hourly_count[used],
+        })
+        self.route_counts = self.route_hourly.groupby('route')['count'].sum().sort_values(ascending=False)
+
+        used = np.flatnonzero(cluster_count)
+        mean = cluster_sum[used] / cluster_count[used]
+        self.cluster_stats = pd.DataFrame({
+            'cluster': used,
+            'count': cluster_count[used],
+            'mean_travel_time': mean,
+            'std_travel_time': np.sqrt(np.maximum(cluster_sumsq[used] / cluster_count[used] - mean ** 2, 0)),
+            'mean_value': cluster_value[used] / cluster_count[used],
+        })
+
+        self.route_daily = pd.concat(daily, ignore_index=True) if daily else pd.DataFrame(
+            columns=['route', 'date', 'mean_travel_time', 'count'])
+        self.rainfall = load_daily_rainfall(rain_dir)
+        self.rows = store.rows
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+        # 每份彙總資料有自己的 LRU 快取，重新載入時資料與快取一起替換
+        self.cached_query = lru_cache(maxsize=cache_size)(self.execute)
+
+    def execute(self, key):
+        """執行查詢，結果由 cached_query 快取"""
+        path, params = key
+        params = dict(params)
+        if path == '/routes':
+            limit = int(params.get('limit', 50))
+            return [dict(zip(('start', 'end'), self.route_name(route)), count=int(count))
+                    for route, count in self.route_counts.head(limit).items()]
+        if path == '/route_hourly':
+            df = self.route_hourly[self.route_hourly['route'] == self.route_code(params['start'], params['end'])]
+            if 'hour' in params:
+                df = df[df['hour'] == int(params['hour'])]
+            return df.drop(columns='route').to_dict(orient='records')
+        if path == '/cluster_stats':
+            return self.cluster_stats.to_dict(orient='records')
+        if path == '/rain_join':
+            df = self.route_daily[self.route_daily['route'] == self.route_code(params['start'], params['end'])]
+            rain = self.rainfall[self.rainfall['觀測站'] == params.get('station', '宜蘭')]
+            df = df.merge(rain[['date', '日累積雨量(mm)']], on='date', how='left')
+            # 雨量檔只記錄有降雨的日子：涵蓋期間內無紀錄視為 0，期間外為未知 (null)
+            covered = df['date'].between(self.rainfall['date'].min(), self.rainfall['date'].max())
+            df['rainfall'] = df.pop('日累積雨量(mm)').where(~covered, lambda r: r.fillna(0.0))
+            if 'min_rain' in params:
+                df = df[df['rainfall'] >= float(params['min_rain'])]
+            df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+            df['rainfall'] = df['rainfall'].astype(object).where(df['rainfall'].notna(), None)
+            return df.drop(columns='route').to_dict(orient='records')
+        raise LookupError(f"不支援的查詢路徑：{path}")
+
+    def route_code(self, start, end):
+        if start not in self.gantry_codes or end not in self.gantry_codes:
+            raise KeyError(f"找不到路段 {start} -> {end}")
+        return self.gantry_codes[start] * len(self.gantries) + self.gantry_codes[end]
+
+    def route_name(self, route):
+        n = len(self.gantries)
+        return self.gantries[route // n], self.gantries[route % n]
+
+
+def normalize_query(path, query):
+    """將查詢正規化為可作為快取鍵值的 tuple"""
+    params = sorted((k.strip().lower(), v.strip()) for k, v in parse_qsl(query) if v.strip())
+    return path.rstrip('/') or '/', tuple(params)
+
+
+class QueryService:
+    """執行查詢並快取結果，資料庫更新時自動重新載入"""
+
+    def __init__(self, store_dir, rain_dir, cache_size=CACHE_SIZE):
+        self.store_dir = store_dir
+        self.rain_dir = rain_dir
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()  # 同一時間只允許一個重新載入
+        self.requests = 0
+        self.reloads = 0
+        # 已替換掉的彙總資料快取的累計命中/未命中次數
+        self.retired_hits = 0
+        self.retired_misses = 0
+        self.aggregates = None
+        self.meta_mtime = None
+        self.reload()
+
+    def reload(self, blocking=True):
+        """重新計算彙總資料並連同快取一起替換；blocking=False 時若已有重新載入進行中則回傳 False"""
+        if not self.reload_lock.acquire(blocking):
+            return False
+        try:
+            meta_mtime = os.path.getmtime(os.path.join(self.store_dir, 'meta.json'))
+            start_time = datetime.now()
+            aggregates = Aggregates(self.store_dir, self.rain_dir, self.cache_size)
+            with self.lock:
+                if self.aggregates is not None:
+                    info = self.aggregates.cached_query.cache_info()
+                    self.retired_hits += info.hits
+                    self.retired_misses += info.misses
+                self.aggregates = aggregates
+                self.meta_mtime = meta_mtime
+                self.reloads += 1
+        finally:
+            self.reload_lock.release()
+        total_time = (datetime.now() - start_time).total_seconds()
+        print(f"已載入彙總資料：{aggregates.rows:,} 筆 (耗時 {total_time:.1f} 秒)")
+        return True
+
+    def reload_if_changed(self):
+        meta_mtime = os.path.getmtime(os.path.join(self.store_dir, 'meta.json'))
+        if meta_mtime != self.meta_mtime:
+            print("偵測到資料庫更新，重新載入...")
+            self.reload(blocking=False)
+
+    def watch(self, interval=RELOAD_INTERVAL):
+        """背景執行緒定期檢查資料庫是否更新"""
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception:
+                    print(traceback.format_exc())
+        stop = threading.Event()
+        threading.Thread(target=loop, daemon=True).start()
+        return stop
+
+    def query(self, path, query):
+        with self.lock:
+            self.requests += 1
+        key = normalize_query(path, query)
+        if key[0] == '/metrics':
+            return self.metrics()
+        with self.lock:
+            agg = self.aggregates
+        # 查詢與快取都屬於同一份彙總資料，重新載入期間仍在執行的查詢只會寫入舊快取
+        return agg.cached_query(key)
+
+    def metrics(self):
+        with self.lock:
+            agg = self.aggregates
+            info = agg.cached_query.cache_info()
+            hits = self.retired_hits + info.hits
+            misses = self.retired_misses + info.misses
+            requests = self.requests
+            reloads = self.reloads
+        return {
+            'requests': requests,
+            'cache_hits': hits,
+            'cache_misses': misses,
+            'cache_hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'cache_size': info.currsize,
+            'cache_max_size': info.maxsize,
+            'reloads': reloads,
+            'reload_in_progress': self.reload_lock.locked(),
+            'loaded_at': agg.loaded_at,
+            'rows': agg.rows,
+        }
+
+
+def make_handler(service):
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            try:
+                if url.path.rstrip('/') == '/reload':
+                    if service.reload(blocking=False):
+                        self.send_json(200, service.metrics())
+                    else:
+                        self.send_json(409, {'error': "重新載入進行中，請稍後再試"})
+                else:
+                    self.send_json(200, service.query(url.path, url.query))
+            except (KeyError, ValueError) as e:
+                self.send_json(400, {'error': f"查詢參數錯誤：{e}"})
+            except LookupError as e:
+                self.send_json(404, {'error': str(e)})
+            except Exception as e:
+                print(traceback.format_exc())
+                self.send_json(500, {'error': str(e)})
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return QueryHandler
+
+
+def main():
+    if not os.path.exists(os.path.join(STORE_DIR, 'meta.json')):
+        print(f"錯誤: 找不到旅次資料庫 {STORE_DIR}，請先執行 trip_store.py")
+        return
+
+    print(f"\n啟動查詢服務...")
+    print(f"旅次資料庫：{STORE_DIR}")
+    print(f"雨量資料：{RAIN_DIR}")
+
+    service = QueryService(STORE_DIR, RAIN_DIR)
+    service.watch()
+    server = ThreadingHTTPServer((HOST, PORT), make_handler(service))
+    print(f"服務位址：http://{HOST}:{PORT}")
+    print("可用查詢：/routes /route_hourly /cluster_stats /rain_join /metrics /reload")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n服務已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# 跨日旅次去重：以 Bloom filter 快速篩選，再以前一日跨午夜旅次的排序雜湊值精確比對
+
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+
+class BloomFilter:
+    """固定記憶體的 Bloom filter，以 64 位元雜湊值的雙重雜湊產生 k 個位置"""
+
+    def __init__(self, num_bits=2 ** 30, num_hashes=7):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = np.zeros((num_bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, hashes):
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        i = np.arange(self.num_hashes, dtype=np.uint64)
+        return (h1[:, None] + i * h2[:, None]) % np.uint64(self.num_bits)
+
+    def add(self, hashes):
+        pos = self._positions(hashes).ravel()
+        np.bitwise_or.at(self.bits, pos >> np.uint64(3), (np.uint64(1) << (pos & np.uint64(7))).astype(np.uint8))
+
+    def contains(self, hashes):
+        pos = self._positions(hashes)
+        bit = (self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+        return bit.all(axis=1)
+
+
+def trip_hashes(chunk):
+    """以 (id, time, location_start) 計算每筆旅次的 64 位元雜湊值 (依欄位位置，不依欄位名稱)"""
+    keys = chunk.iloc[:, :3].astype(str)
+    return pd.util.hash_pandas_object(keys, index=False).values
+
+
+class TripDeduplicator:
+    """逐日串流去重，記憶體用量與全年資料量無關
+
+    跨日重複只會出現在跨越午夜的旅次 (time < 午夜 <= time_end)，因此只保留前一日
+    跨午夜旅次的排序雜湊值作精確比對；Bloom filter 記錄所有跨午夜旅次，
+    用來快速排除絕大多數不可能重複的資料。
+    """
+
+    def __init__(self, bloom_bits=2 ** 30, bloom_hashes=7):
+        self.bloom = BloomFilter(bloom_bits, bloom_hashes)
+        self.day = None
+        self.previous_day = None
+        self.previous_hashes = np.empty(0, dtype=np.uint64)
+        self.boundary_hashes = []
+        self.start_midnight = None
+        self.end_midnight = None
+        self.removed = {}
+
+    def start_day(self, day):
+        """開始處理某一日的壓縮檔"""
+        self.day = datetime(day.year, day.month, day.day)
+        if self.previous_day is None or self.day - self.previous_day != timedelta(days=1):
+            # 與前一份資料不連續，前一日的跨午夜旅次不會重疊
+            self.previous_hashes = np.empty(0, dtype=np.uint64)
+        self.start_midnight = self.day.strftime('%Y-%m-%d %H:%M:%S')
+        self.end_midnight = (self.day + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+        self.boundary_hashes = []
+        self.removed[self.day.date()] = 0
+
+    def filter(self, chunk):
+        """移除與前一日重複的旅次，回傳保留的資料"""
+        if chunk.empty:
+            return chunk
+        # 時間字串格式固定 (YYYY-MM-DD HH:MM:SS)，可直接以字串比較先後
+        times = chunk.iloc[:, 1].astype(str).to_numpy(copy=True)
+        times_end = chunk.iloc[:, 3].astype(str).to_numpy(copy=True)
+
+        # 跨越本日開始午夜的旅次可能與前一日重複；跨越本日結束午夜的旅次需記錄供下一日比對
+        if len(self.previous_hashes):
+            start_cross = (times < self.start_midnight) & (times_end >= self.start_midnight)
+        else:
+            start_cross = np.zeros(len(chunk), dtype=bool)
+        end_cross = (times < self.end_midnight) & (times_end >= self.end_midnight)
+        rows = np.flatnonzero(start_cross | end_cross)
+        if not len(rows):
+            return chunk
+
+        # 只對跨午夜的少數旅次計算雜湊值
+        hashes = trip_hashes(chunk.iloc[rows])
+        candidate = start_cross[rows]
+        duplicate = np.zeros(len(rows), dtype=bool)
+        candidate[candidate] = self.bloom.contains(hashes[candidate])
+        if candidate.any():
+            idx = np.searchsorted(self.previous_hashes, hashes[candidate])
+            idx = np.minimum(idx, len(self.previous_hashes) - 1)
+            duplicate[candidate] = self.previous_hashes[idx] == hashes[candidate]
+
+        boundary = end_cross[rows] & ~duplicate
+        if boundary.any():
+            self.bloom.add(hashes[boundary])
+            self.boundary_hashes.append(hashes[boundary])
+
+        removed = int(duplicate.sum())
+        if not removed:
+            return chunk
+        self.removed[self.day.date()] += removed
+        keep = np.ones(len(chunk), dtype=bool)
+        keep[rows[duplicate]] = False
+        return chunk[keep]
+
+    def end_day(self):
+        """結束某一日的處理，回傳該日移除的重複筆數"""
+        if self.boundary_hashes:
+            self.previous_hashes = np.sort(np.concatenate(self.boundary_hashes))
+        else:
+            self.previous_hashes = np.empty(0, dtype=np.uint64)
+        self.previous_day = self.day
+        self.boundary_hashes = []
+        return self.removed[self.day.date()]
+
+    def report(self):
+        """列出每日移除的重複筆數"""
+        print("\n跨日重複旅次統計：")
+        for day, removed in sorted(self.removed.items()):
+            if removed:
+                print(f"  {day}: 移除 {removed:,} 筆")
+        print(f"共移除 {sum(self.removed.values()):,} 筆重複旅次 ({len(self.removed)} 天)")
+
+
+def archive_date(file_name):
+    """由 M06A_YYYYMMDD.tar.gz 檔名取得日期"""
+    return datetime.strptime(file_name.split('_')[1][:8], '%Y%m%d').date()
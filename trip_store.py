@@ -0,0 +1,314 @@
+# 以記憶體映射的二進位檔儲存旅次資料，可依日期或起始門架快速取出
+
+import os
+import json
+import shutil
+import traceback
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# 每個欄位的固定寬度型別
+COLUMN_DTYPES = {
+    'time': np.int64,            # 起始時間 (epoch 秒，以當地時間計)
+    'time_end': np.int64,        # 結束時間 (epoch 秒，以當地時間計)
+    'location_start': np.int16,  # 起始門架代碼 (對應 meta.json 的 gantries)
+    'location_end': np.int16,    # 結束門架代碼
+    'value': np.float32,         # 數值資料
+    'flag': np.uint8,            # 標記欄位 (Y=1, N=0)
+    'id': np.uint8,              # 原始資料中的識別號碼 (車種)
+    'cluster': np.uint8,         # 聚類結果 (無資料時為 255)
+}
+
+SECONDS_PER_DAY = 86400
+
+
+def _to_epoch_seconds(series):
+    """將時間字串轉換為 epoch 秒 (不做時區轉換)"""
+    ts = pd.to_datetime(series, errors='coerce')
+    return ts, ts.values.astype('datetime64[s]').astype(np.int64)
+
+
+def _encode_gantries(series, gantry_codes):
+    """將門架名稱轉換為整數代碼，並更新全域對照表"""
+    codes, uniques = pd.factorize(series.astype(str))
+    mapping = np.empty(len(uniques), dtype=np.int16)
+    for i, name in enumerate(uniques):
+        if name not in gantry_codes:
+            gantry_codes[name] = len(gantry_codes)
+        mapping[i] = gantry_codes[name]
+    return mapping[codes]
+
+
+def convert_chunk(chunk, gantry_codes):
+    """將一批 CSV 資料轉換為固定寬度的欄位陣列"""
+    ts, time = _to_epoch_seconds(chunk['time'])
+    ts_end, time_end = _to_epoch_seconds(chunk['time_end'])
+
+    # 移除無法解析的時間
+    valid = (ts.notna() & ts_end.notna()).values
+    if not valid.all():
+        print(f"  時間轉換: 有 {(~valid).sum()} 筆資料無法解析，已略過")
+        chunk = chunk[valid]
+        time = time[valid]
+        time_end = time_end[valid]
+
+    arrays = {
+        'time': time,
+        'time_end': time_end,
+        'location_start': _encode_gantries(chunk['location_start'], gantry_codes),
+        'location_end': _encode_gantries(chunk['location_end'], gantry_codes),
+        'value': pd.to_numeric(chunk['value'], errors='coerce').values.astype(np.float32),
+        'flag': (chunk['flag'].astype(str) == 'Y').values.astype(np.uint8),
+        'id': pd.to_numeric(chunk['id'], errors='coerce').fillna(0).values.astype(np.uint8),
+    }
+    if 'cluster' in chunk.columns:
+        arrays['cluster'] = pd.to_numeric(chunk['cluster'], errors='coerce').fillna(255).values.astype(np.uint8)
+    else:
+        arrays['cluster'] = np.full(len(chunk), 255, dtype=np.uint8)
+    return arrays
+
+
+def _scatter_positions(keys, offsets, fill):
+    """計算一批資料依鍵值分桶後的目的位置 (同桶內維持原順序)，並更新各桶已填入的筆數"""
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    counts = np.bincount(keys, minlength=len(fill))
+    group_start = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    dest = offsets[sorted_keys] + fill[sorted_keys] + np.arange(len(keys)) - group_start[sorted_keys]
+    fill += counts
+    return order, dest
+
+
+def new_version():
+    """以建立時間命名的版本代號，可依字串排序"""
+    return datetime.now().strftime('v%Y%m%d_%H%M%S_%f')
+
+
+def publish_version(store_dir, meta):
+    """以 os.replace 更新 meta.json 發布 meta['version'] 子目錄，並清除更舊的版本
+
+    保留剛被取代的前一版 (可能有程序已讀取舊 meta.json 但尚未開啟檔案)；
+    比前一版新的目錄可能是仍在進行中的其他建立程序，不予刪除。
+    仍被其他程序映射的版本 (Windows) 會留到下次發布時再清除。
+    """
+    meta_file = os.path.join(store_dir, 'meta.json')
+    previous = None
+    if os.path.exists(meta_file):
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            previous = json.load(f).get('version')
+    meta_tmp = os.path.join(store_dir, f"meta.json.{meta['version']}.tmp")
+    with open(meta_tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(meta_tmp, meta_file)
+
+    if previous is not None:
+        for name in os.listdir(store_dir):
+            path = os.path.join(store_dir, name)
+            if name < previous and name.startswith('v') and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def build_trip_store(input_file, store_dir, chunk_size=1000000):
+    """由 2024_complete.csv 建立記憶體映射旅次資料庫
+
+    每個階段一次只讀入一批 (chunk_size 筆) 或一天的資料，記憶體用量不隨全年資料量增加。
+    新版本寫入獨立的子目錄，完成後才以 os.replace 更新 meta.json，
+    已開啟舊版本的讀取程序不受影響。
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    version = new_version()
+    version_dir = os.path.join(store_dir, version)
+    os.makedirs(version_dir)
+    usecols = ['id', 'time', 'location_start', 'time_end', 'location_end', 'value', 'flag']
+    header = pd.read_csv(input_file, nrows=0).columns
+    if 'cluster' in header:
+        usecols.append('cluster')
+
+    # 第一階段：分批轉換，依序寫入暫存的原始二進位檔，同時統計每日筆數
+    gantry_codes = {}
+    day_counts = {}
+    raw_files = {name: os.path.join(version_dir, f"{name}.raw") for name in COLUMN_DTYPES}
+    handles = {name: open(path, 'wb') for name, path in raw_files.items()}
+    rows = 0
+    try:
+        reader = pd.read_csv(input_file, usecols=usecols, chunksize=chunk_size)
+        for chunk_num, chunk in enumerate(reader, 1):
+            arrays = convert_chunk(chunk, gantry_codes)
+            for name, arr in arrays.items():
+                arr.astype(COLUMN_DTYPES[name], copy=False).tofile(handles[name])
+            keys, counts = np.unique(arrays['time'] // SECONDS_PER_DAY, return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                day_counts[key] = day_counts.get(key, 0) + count
+            rows += len(arrays['time'])
+            print(f"已轉換第 {chunk_num} 批，累計 {rows:,} 筆")
+    finally:
+        for handle in handles.values():
+            handle.close()
+    if rows == 0:
+        raise ValueError(f"{input_file} 中沒有可用的資料")
+
+    # 日期索引：每一天在資料中的起訖位置
+    day_keys = np.array(sorted(day_counts), dtype=np.int64)
+    day_offsets = np.concatenate([[0], np.cumsum([day_counts[k] for k in day_keys.tolist()])]).astype(np.int64)
+    np.save(os.path.join(version_dir, 'day_keys.npy'), day_keys)
+    np.save(os.path.join(version_dir, 'day_offsets.npy'), day_offsets)
+
+    # 第二階段：分批將資料依日期分桶寫入 .npy
+    raw = {name: np.memmap(path, dtype=COLUMN_DTYPES[name], mode='r', shape=(rows,))
+           for name, path in raw_files.items()}
+    out = {name: np.lib.format.open_memmap(os.path.join(version_dir, f"{name}.npy"), mode='w+',
+                                           dtype=COLUMN_DTYPES[name], shape=(rows,))
+           for name in COLUMN_DTYPES}
+    fill = np.zeros(len(day_keys), dtype=np.int64)
+    for start in range(0, rows, chunk_size):
+        days = np.searchsorted(day_keys, raw['time'][start:start + chunk_size] // SECONDS_PER_DAY)
+        order, dest = _scatter_positions(days, day_offsets, fill)
+        for name in COLUMN_DTYPES:
+            out[name][dest] = raw[name][start:start + chunk_size][order]
+
+    # 第三階段：逐日依起始時間排序
+    for i in range(len(day_keys)):
+        s = slice(int(day_offsets[i]), int(day_offsets[i + 1]))
+        order = np.argsort(out['time'][s], kind='stable')
+        for name in COLUMN_DTYPES:
+            out[name][s] = out[name][s][order]
+
+    # 第四階段：門架索引，依起始門架分桶的列號 (同門架內維持時間順序)
+    location_start = out['location_start']
+    counts = np.zeros(len(gantry_codes), dtype=np.int64)
+    for start in range(0, rows, chunk_size):
+        counts += np.bincount(location_start[start:start + chunk_size], minlength=len(gantry_codes))
+    gantry_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    gantry_order = np.lib.format.open_memmap(os.path.join(version_dir, 'gantry_order.npy'), mode='w+',
+                                             dtype=np.int64, shape=(rows,))
+    fill = np.zeros(len(gantry_codes), dtype=np.int64)
+    for start in range(0, rows, chunk_size):
+        block = location_start[start:start + chunk_size].astype(np.int64)
+        order, dest = _scatter_positions(block, gantry_offsets, fill)
+        gantry_order[dest] = start + order
+    np.save(os.path.join(version_dir, 'gantry_offsets.npy'), gantry_offsets)
+
+    # 釋放所有記憶體映射後才能刪除暫存檔 (Windows 無法刪除仍被映射的檔案)
+    for arr in out.values():
+        arr.flush()
+    gantry_order.flush()
+    del raw, out, gantry_order, location_start, order, dest, block
+    for path in raw_files.values():
+        os.remove(path)
+
+    meta = {
+        'version': version,
+        'rows': int(rows),
+        'source': os.path.abspath(input_file),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'columns': {name: np.dtype(dtype).name for name, dtype in COLUMN_DTYPES.items()},
+        'gantries': sorted(gantry_codes, key=gantry_codes.get),
+    }
+    publish_version(store_dir, meta)
+    return rows
+
+
+class TripStore:
+    """以 np.load(mmap_mode='r') 開啟的旅次資料庫
+
+    資料依起始時間排序，取出某一天是零複製的切片；取出某一門架則是依門架索引
+    (gantry_order) 取值，只複製該門架的資料列。
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.version_dir = os.path.join(store_dir, self.meta['version'])
+        self.rows = self.meta['rows']
+        self.gantries = self.meta['gantries']
+        self.gantry_codes = {name: i for i, name in enumerate(self.gantries)}
+        self.columns = {name: self._load(name) for name in self.meta['columns']}
+        self.day_keys = self._load('day_keys')
+        self.day_offsets = self._load('day_offsets')
+        self.gantry_order = self._load('gantry_order')
+        self.gantry_offsets = self._load('gantry_offsets')
+
+    def _load(self, name):
+        return np.load(os.path.join(self.version_dir, f"{name}.npy"), mmap_mode='r')
+
+    def __len__(self):
+        return self.rows
+
+    def days(self):
+        """資料中包含的所有日期"""
+        return self.day_keys.astype('datetime64[D]')
+
+    def day_slice(self, date):
+        """指定日期 (字串、date 或 datetime64) 在資料中的範圍"""
+        key = np.datetime64(date, 'D').astype(np.int64)
+        i = np.searchsorted(self.day_keys, key)
+        if i == len(self.day_keys) or self.day_keys[i] != key:
+            return slice(0, 0)
+        return slice(int(self.day_offsets[i]), int(self.day_offsets[i + 1]))
+
+    def day(self, date, columns=None):
+        """取出指定日期的資料 (零複製的記憶體映射切片)"""
+        s = self.day_slice(date)
+        return {name: self.columns[name][s] for name in (columns or self.columns)}
+
+    def gantry_rows(self, gantry):
+        """起始門架的所有列號 (依時間排序)"""
+        code = self.gantry_codes.get(gantry, -1) if isinstance(gantry, str) else int(gantry)
+        if not 0 <= code < len(self.gantries):
+            return self.gantry_order[0:0]
+        return self.gantry_order[self.gantry_offsets[code]:self.gantry_offsets[code + 1]]
+
+    def gantry(self, gantry, columns=None):
+        """取出指定起始門架的資料 (依索引取值，會複製該門架的資料列)"""
+        rows = self.gantry_rows(gantry)
+        return {name: self.columns[name][rows] for name in (columns or self.columns)}
+
+    def to_frame(self, data):
+        """將欄位陣列轉回 pandas DataFrame，並還原時間與門架名稱"""
+        df = pd.DataFrame({name: np.asarray(arr) for name, arr in data.items()})
+        names = np.array(self.gantries, dtype=object)
+        for col in ('time', 'time_end'):
+            if col in df:
+                df[col] = pd.to_datetime(df[col], unit='s')
+        for col in ('location_start', 'location_end'):
+            if col in df:
+                df[col] = names[df[col].values]
+        return df
+
+
+def main():
+    # 設定資料路徑
+    input_file = 'D:/highway_processed/2024_complete.csv'
+    store_dir = 'D:/highway_processed/trip_store'
+
+    if not os.path.exists(input_file):
+        print(f"錯誤: 找不到輸入檔案 {input_file}")
+        return
+
+    print(f"\n開始建立旅次資料庫...")
+    print(f"讀取檔案：{input_file}")
+    start_time = datetime.now()
+
+    try:
+        rows = build_trip_store(input_file, store_dir)
+    except Exception as e:
+        print(f"\n建立資料庫時發生錯誤：")
+        print(traceback.format_exc())
+        return
+
+    total_time = (datetime.now() - start_time).total_seconds()
+    store = TripStore(store_dir)
+    store_size = sum(os.path.getsize(os.path.join(store.version_dir, f))
+                     for f in os.listdir(store.version_dir)) / (1024 * 1024)
+    print("\n建立完成！")
+    print(f"總處理時間：{total_time:.1f} 秒")
+    print(f"資料筆數：{rows:,} 筆")
+    print(f"日期數：{len(store.day_keys)} 天，門架數：{len(store.gantries)} 個")
+    print(f"輸出目錄：{store_dir}")
+    print(f"資料庫大小：{store_size:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()